@@ -2,11 +2,23 @@
 
 import streamlit as st
 import streamlit.components.v1 as components
-import os, json, base64, time
+import os, re, json, time, hashlib, struct, asyncio, threading
+import importlib.util
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
-from google import genai
-from google.genai import types
+from collections import deque
+from itertools import islice
+from bisect import bisect_right
+from functools import cache
+
+try:
+    import pybase64 as base64  # SIMD codec, same API as the stdlib module
+except ImportError:
+    import base64
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 st.set_page_config(page_title="Audiobook Reader", page_icon="📖", layout="centered")
 
@@ -20,13 +32,23 @@ _CACHE = Path(".cache/last_book.json")
 
 def _save_cache(name, chapters):
     _CACHE.parent.mkdir(exist_ok=True)
-    _CACHE.write_text(json.dumps({"name": name, "chapters": chapters}))
+    d = {"name": name, "chapters": [{"title": c.title, "text": c.text} for c in chapters]}
+    if orjson:
+        _CACHE.write_bytes(orjson.dumps(d))
+    else:
+        _CACHE.write_text(json.dumps(d), encoding="utf-8")
 
 
 def _load_cache():
     try:
-        d = json.loads(_CACHE.read_text())
-        return d if d.get("chapters") else None
+        raw = _CACHE.read_bytes()
+        d = orjson.loads(raw) if orjson else json.loads(raw)
+        if not d.get("chapters"):
+            return None
+        from parsers import Chapter
+
+        d["chapters"] = [Chapter(c["title"], c["text"]) for c in d["chapters"]]
+        return d
     except Exception:
         return None
 
@@ -35,27 +57,29 @@ def _dedup_titles(chapters):
     """Append (2), (3) etc. to duplicate chapter titles."""
     counts = {}
     for ch in chapters:
-        t = ch["title"]
+        t = ch.title
         counts[t] = counts.get(t, 0) + 1
     dupes = {t for t, c in counts.items() if c > 1}
     if not dupes:
         return chapters
     seen = {}
     for ch in chapters:
-        t = ch["title"]
+        t = ch.title
         if t in dupes:
             seen[t] = seen.get(t, 0) + 1
-            ch["title"] = f"{t} ({seen[t]})"
+            ch.title = f"{t} ({seen[t]})"
     return chapters
 
 
 # ── Voices & styles (Puck first = default) ──────────────
-VOICES = [
+VOICES = (
     ("Puck", "Upbeat"), ("Kore", "Firm"), ("Charon", "Informative"),
     ("Enceladus", "Breathy"), ("Zephyr", "Bright"), ("Fenrir", "Excitable"),
     ("Aoede", "Breezy"), ("Leda", "Youthful"), ("Achernar", "Soft"),
     ("Sulafat", "Warm"), ("Gacrux", "Mature"), ("Schedar", "Even"),
-]
+)
+VOICE_NAMES = tuple(n for n, _ in VOICES)
+VOICE_LABELS = tuple(f"{n} — {s}" for n, s in VOICES)
 
 STYLES = {
     "Storyteller": "Read expressively like an engaging storyteller with natural emotion",
@@ -67,33 +91,151 @@ STYLES = {
 # ── API client ──────────────────────────────────────────
 @st.cache_resource
 def _make_client(key):
+    import httpx
+    from google import genai  # grpc/protobuf stack: import only once a key exists
+    from google.genai import types
+
+    # one live connection per in-flight request (prefetch depth tops out at 8),
+    # kept open long enough that the warm-up and pauses between chapters don't
+    # drop back to a cold TLS handshake. These are httpx settings: if aiohttp
+    # is installed, genai uses it for async calls and silently ignores them.
+    opts = types.HttpOptions(async_client_args={
+        "limits": httpx.Limits(max_connections=8, max_keepalive_connections=8,
+                               keepalive_expiry=300),
+        "http2": importlib.util.find_spec("h2") is not None,
+    })
     try:
-        return genai.Client(vertexai=True, api_key=key)
+        return genai.Client(vertexai=True, api_key=key, http_options=opts)
     except Exception:
-        return genai.Client(api_key=key)
+        return genai.Client(api_key=key, http_options=opts)
 
 
 def get_client():
-    for name in ("VERTEX_API_KEY", "GEMINI_API_KEY"):
-        k = None
+    """Resolve the API key once per session; later reruns reuse the client.
+    The first resolution also pre-warms the connection."""
+    if "_client" in st.session_state:
+        return st.session_state._client
+    try:
+        secrets = {n: st.secrets.get(n) for n in ("VERTEX_API_KEY", "GEMINI_API_KEY")}
+    except FileNotFoundError:  # no secrets.toml at all
+        secrets = {}
+    k = (secrets.get("VERTEX_API_KEY") or os.environ.get("VERTEX_API_KEY")
+         or secrets.get("GEMINI_API_KEY") or os.environ.get("GEMINI_API_KEY"))
+    if not k:
+        return None
+    client = st.session_state._client = _make_client(k)
+    asyncio.run_coroutine_threadsafe(_warm(client), _event_loop())
+    return client
+
+
+# ── TTS audio cache (content-addressed, LRU by mtime) ───
+_TTS_CACHE = Path(".cache/tts")
+_TTS_CACHE_MAX = 2 << 30  # 2 GB
+
+
+@st.cache_resource
+def _tts_cache_state():
+    """Running byte total of the cache, shared by all sessions so a write
+    doesn't rescan the directory; None until the first scan."""
+    return {"lock": threading.Lock(), "bytes": None}
+
+
+_TTS_CACHE_STATE = _tts_cache_state()
+
+
+def _tts_cache_path(text, voice, prefix):
+    key = hashlib.blake2b(f"{voice}|{prefix}|{text}".encode(), digest_size=16).hexdigest()
+    return _TTS_CACHE / f"{key}.pcm"
+
+
+def _tts_cache_get(path):
+    try:
+        pcm = path.read_bytes()
+        os.utime(path)  # mark as recently used
+        return pcm
+    except OSError:
+        return None
+
+
+def _tts_cache_put(path, pcm):
+    try:
+        _TTS_CACHE.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{time.monotonic_ns()}.tmp")
+        tmp.write_bytes(pcm)
+        os.replace(tmp, path)
+        state = _TTS_CACHE_STATE
+        with state["lock"]:
+            if state["bytes"] is not None:
+                state["bytes"] += len(pcm)
+            # rescan only at startup and once the estimate passes the budget
+            if state["bytes"] is None or state["bytes"] > _TTS_CACHE_MAX:
+                state["bytes"] = _tts_cache_evict()
+    except OSError:
+        pass
+
+
+def _tts_cache_evict():
+    """Drop least-recently-used entries once the cache exceeds its budget;
+    returns the size left on disk."""
+    files = []
+    for p in _TTS_CACHE.glob("*.pcm"):
         try:
-            k = st.secrets[name]
-        except (KeyError, FileNotFoundError):
-            pass
-        if not k:
-            k = os.environ.get(name)
-        if k:
-            return _make_client(k)
-    return None
+            info = p.stat()
+        except OSError:
+            continue
+        files.append((info.st_mtime, info.st_size, p))
+    total = sum(size for _, size, _ in files)
+    for _, size, p in sorted(files):
+        if total <= _TTS_CACHE_MAX:
+            break
+        p.unlink(missing_ok=True)
+        total -= size
+    return total
 
 
 # ── TTS ─────────────────────────────────────────────────
-def tts(client, text, voice, style):
-    """Gemini TTS → raw PCM bytes. Retries up to 3x with backoff."""
-    prompt = f"{style}:\n\n{text}" if style else text
+@st.cache_resource
+def _event_loop():
+    """Background asyncio loop shared by all sessions; TTS requests run here
+    concurrently on one thread over the client's pooled async connections."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="tts-loop", daemon=True).start()
+    return loop
+
+
+def submit_tts(client, text, voice, prefix):
+    """Schedule tts() on the background loop → concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(
+        tts(client, text, voice, prefix), _event_loop()
+    )
+
+
+async def _warm(client):
+    """Open the HTTPS connection (TCP + TLS) before the first TTS request."""
+    try:
+        await client.aio.models.list(config={"page_size": 1})
+    except Exception:
+        pass
+
+
+def style_prefix(style):
+    """Prompt prefix for a style preset; built once per playback, not per chunk."""
+    return f"{style}:\n\n" if style else ""
+
+
+async def tts(client, text, voice, prefix):
+    """Gemini TTS → raw PCM bytes. Served from disk cache when possible;
+    otherwise retries up to 3x with backoff."""
+    from google.genai import types
+
+    cache_path = _tts_cache_path(text, voice, prefix)
+    pcm = await asyncio.to_thread(_tts_cache_get, cache_path)  # file I/O off the shared loop
+    if pcm:
+        return pcm
+    prompt = prefix + text
     for attempt in range(3):
         try:
-            r = client.models.generate_content(
+            r = await client.aio.models.generate_content(
                 model="gemini-2.5-flash-preview-tts",
                 contents=prompt,
                 config=types.GenerateContentConfig(
@@ -107,40 +249,212 @@ def tts(client, text, voice, style):
                     ),
                 ),
             )
-            audio_parts = []
-            for cand in getattr(r, "candidates", []):
-                for part in getattr(getattr(cand, "content", None), "parts", []):
+            buf = bytearray()
+            for cand in getattr(r, "candidates", None) or ():
+                parts = getattr(getattr(cand, "content", None), "parts", None) or ()
+                for part in parts:
                     data = getattr(getattr(part, "inline_data", None), "data", None)
                     if data:
-                        audio_parts.append(data)
-            if audio_parts:
-                return b"".join(audio_parts)
+                        buf.extend(data)
+            if buf:
+                pcm = bytes(buf)
+                await asyncio.to_thread(_tts_cache_put, cache_path, pcm)
+                return pcm
         except Exception:
             if attempt == 2:
                 raise
-            time.sleep(2)
+            await asyncio.sleep(2)
     raise RuntimeError("No audio returned after 3 attempts.")
 
 
+_WORD_RE = re.compile(r"\S+")
+_SENT_END_RE = re.compile(r"[.!?]+[\"'”’)\]]*(?=\s|$)")
+_INITIAL_RE = re.compile(r"[^\W\d_]\.$")  # "J." in "J. R. R. Tolkien"
+_ABBREV = frozenset({
+    "mr.", "mrs.", "ms.", "dr.", "st.", "jr.", "sr.", "prof.", "vs.",
+    "e.g.", "i.e.", "no.", "fig.", "vol.", "mt.", "capt.", "gen.", "lt.",
+})
+_MIN_CHUNK = 10  # chars; shorter fragments are glued onto a neighbour
+
+
+def _sentence_ends(text, starts):
+    """Word indices just past each sentence-final word. One regex pass over
+    the text; only punctuation hits are inspected, not every word."""
+    ends = []
+    for m in _SENT_END_RE.finditer(text):
+        w = bisect_right(starts, m.start()) - 1  # word holding the punctuation
+        word = text[starts[w] : m.end()].lower().lstrip("\"'“‘([")
+        if word not in _ABBREV and not _INITIAL_RE.fullmatch(word):
+            ends.append(w + 1)
+    return ends
+
+
 def chunk_text(text, n=100):
-    words = text.split()
-    return [" ".join(words[i : i + n]) for i in range(0, len(words), n)] or [""]
+    """Split into chunks of at most n words, cutting after the last sentence
+    end that fits so TTS never starts or stops mid-sentence. A sentence longer
+    than n words is cut at the word limit. Chunks are slices of `text`, cut
+    from an offset index rather than from per-word strings."""
+    starts = [m.start() for m in _WORD_RE.finditer(text)]
+    if not starts:
+        return [""]
+    ends = _sentence_ends(text, starts)
+    cuts = [0]  # word index where each chunk starts
+    while len(starts) - cuts[-1] > n:
+        c = cuts[-1]
+        j = bisect_right(ends, c + n) - 1
+        cuts.append(ends[j] if j >= 0 and ends[j] > c else c + n)
+    bounds = [starts[c] for c in cuts] + [len(text)]
+    chunks = [text[a:b].rstrip() for a, b in zip(bounds, bounds[1:])]
+    # glue fragments too short to voice onto the next chunk (or the previous one)
+    out = []
+    for ck in chunks:
+        if out and len(out[-1]) < _MIN_CHUNK:
+            out[-1] = f"{out[-1]} {ck}"
+        else:
+            out.append(ck)
+    if len(out) > 1 and len(out[-1]) < _MIN_CHUNK:
+        tail = out.pop()
+        out[-1] = f"{out[-1]} {tail}"
+    return out
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _chunked_cached(key, _text, n):
+    return chunk_text(_text, n)
+
+
+def _chunked(text, n):
+    """chunk_text memoized across reruns (every widget click re-runs the script).
+    Keyed by a blake2b digest: st.cache_data skips hashing the leading-underscore
+    argument, so the chapter text is hashed once here instead of by Streamlit."""
+    key = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    return _chunked_cached(key, text, n)
+
+
+# ── AI Clean ────────────────────────────────────────────
+_CLEAN_MODEL = "gemini-2.5-flash"
+_CLEAN_PROMPT = (
+    "Clean this book chapter text for reading aloud. Remove page numbers, "
+    "running headers and footers, footnote markers and formatting artifacts, "
+    "and rejoin words hyphenated across line breaks. Do not summarize, reword "
+    "or add anything. Return only the cleaned text.\n\n"
+)
+_CLEAN_WINDOW = 20_000  # chars per request
+_CLEAN_WORKERS = 4
+_PARA_RE = re.compile(r"\n\s*\n")
+
+
+def _clean_pieces(para, size):
+    """Cut a paragraph longer than `size` at its last line break that fits,
+    else its last sentence end, else its last space, else hard at `size`."""
+    while len(para) > size:
+        head = para[:size]
+        cut = head.rfind("\n")
+        if cut <= 0:
+            cut = max((m.end() for m in _SENT_END_RE.finditer(head)), default=0)
+        if cut <= 0:
+            cut = head.rfind(" ")
+        if cut <= 0:
+            cut = size
+        yield para[:cut].rstrip()
+        para = para[cut:].lstrip()
+    yield para
+
+
+def _clean_windows(text, size=_CLEAN_WINDOW):
+    """Split on paragraph breaks into windows of at most `size` chars. Text
+    with only single newlines (every DOCX chapter) has no paragraph breaks,
+    so long paragraphs are cut further by _clean_pieces."""
+    windows, buf, n = [], [], 0
+    for para in _PARA_RE.split(text):
+        for piece in _clean_pieces(para, size):
+            if buf and n + len(piece) > size:
+                windows.append("\n\n".join(buf))
+                buf, n = [], 0
+            buf.append(piece)
+            n += len(piece) + 2
+    if buf:
+        windows.append("\n\n".join(buf))
+    return windows
+
+
+async def _clean_all(client, windows):
+    from google.genai import types
+
+    sem = asyncio.Semaphore(_CLEAN_WORKERS)
+
+    async def one(w):
+        async with sem:
+            r = await client.aio.models.generate_content(
+                model=_CLEAN_MODEL, contents=_CLEAN_PROMPT + w
+            )
+        # a reply cut short (MAX_TOKENS, SAFETY, …) or one that dropped half
+        # the window would silently lose text: keep the original instead
+        out = (r.text or "").strip()
+        done = r.candidates and r.candidates[0].finish_reason == types.FinishReason.STOP
+        return out if done and len(out) >= len(w) // 2 else w
+
+    return await asyncio.gather(*(one(w) for w in windows))
+
+
+def ai_clean(client, text):
+    """Clean a whole chapter with Gemini. Windows are sent in parallel on the
+    TTS event loop and reassembled in order."""
+    fut = asyncio.run_coroutine_threadsafe(
+        _clean_all(client, _clean_windows(text)), _event_loop()
+    )
+    return "\n\n".join(fut.result())
 
 
 # ── JS audio player ─────────────────────────────────────
 # Uses <audio> elements instead of Web Audio API so the browser's
 # built-in WSOLA time-stretcher preserves pitch at any speed
 # (same mechanism YouTube uses).
-def init_player():
+def _parent_script(js):
+    """Run `js` as a <script> of the parent page, so its functions and
+    listeners belong to the app's window rather than this component iframe.
+    Streamlit unmounts component iframes on reruns, and browsers refuse to
+    run callbacks whose document is gone."""
+    src = json.dumps(js).replace("</", "<\\/")  # keep "</script>" out of the iframe HTML
+    components.html(
+        "<script>var d=window.parent.document,s=d.createElement('script');"
+        f"s.textContent={src};d.head.appendChild(s);s.remove();</script>",
+        height=0,
+    )
+
+
+def init_player(gen):
+    """Create the player for playback session `gen`. Chunks of that session
+    that reached the parent window first are waiting in its inbox."""
     js = """
     (function() {
-        var p = window.parent;
+        var p = window;  /* runs in the parent page, see _parent_script */
         if (p._player) try { p._player.stop(); } catch(e) {}
         p._player = {
-            queue: [], current: null, speed: p._desiredSpeed || 1.0, paused: false,
+            gen: GEN,
+            queue: [], current: null, speed: p._desiredSpeed || 1.0,
+            paused: false, stopped: false,
+
+            /* Take this session's chunks from the inbox; keep newer ones
+               for the next player, drop stale ones. */
+            drain: function() {
+                var box = p._audioInbox || [], keep = [];
+                for (var i = 0; i < box.length; i++) {
+                    var d = box[i];
+                    if (d.gen === this.gen) this.addChunk(d.audio, d.mime);
+                    else if (d.gen > this.gen) keep.push(d);
+                }
+                p._audioInbox = keep;
+            },
 
-            addChunk: function(b64) {
-                var url = URL.createObjectURL(this._wav(b64));
+            /* Audio elements, blobs, URLs and these callbacks all live in the
+               parent window, so playback survives reruns. */
+            addChunk: function(b64, mime) {
+                if (this.stopped) return;
+                /* native base64 decoder where available (Chrome 140+, Firefox 133+, Safari 18.2+) */
+                var bytes = Uint8Array.fromBase64 ? Uint8Array.fromBase64(b64)
+                    : Uint8Array.from(p.atob(b64), function(c) { return c.charCodeAt(0); });
+                var url = p.URL.createObjectURL(new p.Blob([bytes], {type: mime || 'audio/wav'}));
                 this.queue.push(url);
                 if (!this.current && !this.paused) this._next();
             },
@@ -148,11 +462,12 @@ def init_player():
             _next: function() {
                 if (this.queue.length === 0) { this.current = null; return; }
                 var url = this.queue.shift();
-                var a = new Audio(url);
+                var a = p.document.createElement('audio');
+                a.src = url;
                 a.playbackRate = this.speed;
                 var self = this;
                 a.onended = function() {
-                    URL.revokeObjectURL(url);
+                    p.URL.revokeObjectURL(url);
                     a.onended = null;
                     self._next();
                 };
@@ -177,66 +492,136 @@ def init_player():
                     this.current.onended = null;
                     this.current = null;
                 }
-                this.queue.forEach(function(u) { URL.revokeObjectURL(u); });
+                this.queue.forEach(function(u) { p.URL.revokeObjectURL(u); });
                 this.queue = [];
                 this.paused = false;
-            },
-
-            /* Convert raw 24 kHz 16-bit mono PCM (base64) → WAV Blob */
-            _wav: function(b64) {
-                var bin = atob(b64);
-                var pcm = new Uint8Array(bin.length);
-                for (var i = 0; i < bin.length; i++) pcm[i] = bin.charCodeAt(i);
-                var h = new ArrayBuffer(44), d = new DataView(h);
-                d.setUint32(0,  0x52494646, false);
-                d.setUint32(4,  36 + pcm.length, true);
-                d.setUint32(8,  0x57415645, false);
-                d.setUint32(12, 0x666d7420, false);
-                d.setUint32(16, 16, true);
-                d.setUint16(20, 1, true);
-                d.setUint16(22, 1, true);
-                d.setUint32(24, 24000, true);
-                d.setUint32(28, 48000, true);
-                d.setUint16(32, 2, true);
-                d.setUint16(34, 16, true);
-                d.setUint32(36, 0x64617461, false);
-                d.setUint32(40, pcm.length, true);
-                return new Blob([h, pcm], {type: 'audio/wav'});
+                this.stopped = true;
             }
         };
+
+        /* Message bridge: chunk iframes drop {audio, mime, gen} into the
+           parent's inbox and ring with an 'audio' message, so a chunk that
+           lands before this player exists is queued instead of lost.
+           Control actions from Python arrive on the same channel. Only
+           same-origin senders count: the app's component iframes already
+           reach into this document, so any other window is a stranger. */
+        if (p._onAudioMsg) p.removeEventListener('message', p._onAudioMsg);
+        p._onAudioMsg = function(e) {
+            var pl = p._player;
+            if (!pl || e.origin !== p.location.origin) return;
+            if (e.data === 'audio') pl.drain();
+            else if (e.data && e.data.action === 'pause') pl.togglePause();
+            else if (e.data && e.data.action === 'stop') pl.stop();
+        };
+        p.addEventListener('message', p._onAudioMsg);
+        p._player.drain();
     })();
     """
-    components.html(f"<script>{js}</script>", height=0)
+    _parent_script(js.replace("GEN", str(gen)))
+
+
+# 44-byte RIFF/WAVE header; only the two size fields vary per chunk
+_WAV_HEAD = struct.Struct("<4sI4s4sIHHIIHH4sI")
 
 
-_MAX_SEG = 1_200_000
+def _wav(pcm, rate=24000):
+    """16-bit mono PCM → WAV bytes: one header pack, one concatenation."""
+    n = len(pcm)
+    return _WAV_HEAD.pack(
+        b"RIFF", 36 + n, b"WAVE", b"fmt ", 16, 1, 1, rate, rate * 2, 2, 16, b"data", n,
+    ) + pcm
+
+
+HAS_OPUS = importlib.util.find_spec("av") is not None  # optional: pip install av
+
+
+def _opus(pcm, rate=24000):
+    """Mono 16-bit PCM → Ogg Opus bytes (~32 kbps) via PyAV's bundled libopus."""
+    import io
+    import av
+    import numpy as np
+
+    buf = io.BytesIO()
+    with av.open(buf, "w", format="ogg") as out:
+        stream = out.add_stream("libopus", rate=rate, layout="mono")
+        stream.bit_rate = 32000
+        frame = av.AudioFrame.from_ndarray(
+            np.frombuffer(pcm, dtype="<i2").reshape(1, -1), format="s16", layout="mono"
+        )
+        frame.sample_rate = rate
+        for packet in stream.encode(frame):
+            out.mux(packet)
+        for packet in stream.encode(None):
+            out.mux(packet)
+    return buf.getvalue()
 
 
-def send_audio(pcm, container):
-    """Send PCM to JS player. Each segment gets its own iframe in the container."""
+@cache
+def _lowpass():
+    """Windowed-sinc low-pass (7.2 kHz at 24 kHz) applied before dropping to 16 kHz."""
+    import numpy as np
+
+    taps = np.sinc(0.6 * np.arange(-15, 16)) * np.hamming(31)
+    return taps / taps.sum()
+
+
+def _to_16k(pcm):
+    """24 kHz → 16 kHz int16 PCM: anti-alias filter, then sample every 1.5 input frames."""
+    import numpy as np
+
+    x = np.convolve(np.frombuffer(pcm, dtype="<i2").astype(np.float32), _lowpass(), mode="same")
+    y = np.interp(np.arange(0, len(x) - 1, 1.5), np.arange(len(x)), x)
+    return np.clip(np.rint(y), -32768, 32767).astype("<i2").tobytes()
+
+
+_SILENCE_PEAK = 200  # int16 amplitude below which a chunk is treated as dead air
+
+
+def _peak(pcm):
+    import numpy as np  # first audio chunk pays the import, not the first page render
+
+    a = np.frombuffer(pcm, dtype="<i2")
+    return max(int(a.max()), -int(a.min())) if a.size else 0
+
+
+def send_audio(pcm, container, gen, opus=False, low_rate=False):
+    """Send one chunk's PCM to the JS player as a single WAV (or Ogg Opus)
+    blob, posted through the message bridge. Near-silent chunks are dropped
+    before encoding."""
     if len(pcm) % 2:
         pcm += b"\x00"
-    for off in range(0, len(pcm), _MAX_SEG):
-        seg = pcm[off : off + _MAX_SEG]
-        b64 = base64.b64encode(seg).decode("ascii")
-        with container:
-            components.html(
-                f'<script>(function(){{ var p=window.parent._player; if(p) p.addChunk("{b64}"); }})();</script>',
-                height=0,
-            )
+    if _peak(pcm) < _SILENCE_PEAK:
+        return
+    rate = 24000
+    if low_rate:
+        pcm, rate = _to_16k(pcm), 16000
+    data, mime = (_opus(pcm, rate), "audio/ogg") if opus else (_wav(pcm, rate), "audio/wav")
+    b64 = base64.b64encode(data).decode("ascii")
+    js = (
+        "var w=window.parent;"
+        f'(w._audioInbox=w._audioInbox||[]).push({{audio:"{b64}",mime:"{mime}",gen:{gen}}});'
+        "w.postMessage('audio','*');"
+    )
+    with container:
+        components.html(f"<script>{js}</script>", height=0)
 
 
 def player_action(action):
-    js = {
-        "pause": "p.togglePause();",
-        "stop": "p.stop();",
-    }
+    """Post a control action ("pause" or "stop") to the player's message listener."""
     components.html(
-        f'<script>(function(){{ var p=window.parent._player; if(p) {{ {js[action]} }} }})();</script>',
+        f"<script>window.parent.postMessage({{action:'{action}'}},'*');</script>",
         height=0,
     )
 
 
+def _stop_pipeline():
+    """Drop the session's playback pipeline and cancel its pending TTS calls."""
+    pb = st.session_state.pop("_pb", None)
+    if pb:
+        for _, fut, _ in pb["inflight"]:
+            fut.cancel()
+
+
 # ── Session defaults ────────────────────────────────────
 if "ch_idx" not in st.session_state:
     st.session_state.ch_idx = 0
@@ -247,14 +632,28 @@ with st.sidebar:
     voice_idx = st.selectbox(
         "Voice",
         range(len(VOICES)),
-        format_func=lambda i: f"{VOICES[i][0]} — {VOICES[i][1]}",
+        format_func=VOICE_LABELS.__getitem__,
     )
-    voice = VOICES[voice_idx][0]
+    voice = VOICE_NAMES[voice_idx]
 
     style_name = st.selectbox("Style", list(STYLES.keys()))
     style = STYLES[style_name]
 
     wpc = st.slider("Words / chunk", 20, 200, 100, 10)
+    depth = st.slider(
+        "Prefetch depth", 1, 8, 4,
+        help="TTS requests kept in flight ahead of playback. Lower it if you hit Gemini rate limits.",
+    )
+    opus = st.checkbox(
+        "Compress audio (Opus)",
+        value=False,  # a browser that can't decode Ogg Opus would stall silently
+        disabled=not HAS_OPUS,
+        help="~12× less data per chunk. Needs the optional `av` package; older Safari can't play Ogg Opus.",
+    )
+    low_rate = st.checkbox(
+        "Data saver (16 kHz)",
+        help="Resample speech to 16 kHz before sending: a third less data, still clear for voice.",
+    )
 
     st.divider()
     mode = st.radio("Input", ["Upload", "Paste"], horizontal=True)
@@ -273,6 +672,7 @@ with st.sidebar:
                     st.session_state.chapters = parsed
                     st.session_state.ch_idx = 0
                     st.session_state._fkey = fkey
+                    st.session_state.book_name = f.name
                     _save_cache(f.name, parsed)
                     st.success(f"{len(parsed)} chapter(s)")
                 except Exception as e:
@@ -284,6 +684,7 @@ with st.sidebar:
 
             st.session_state.chapters = _dedup_titles(parse_pasted_text(pasted))
             st.session_state.ch_idx = 0
+            st.session_state.book_name = "Pasted"
             _save_cache("Pasted", st.session_state.chapters)
 
 # ── Main ────────────────────────────────────────────────
@@ -298,6 +699,7 @@ if "chapters" not in st.session_state:
     cached = _load_cache()
     if cached:
         st.session_state.chapters = _dedup_titles(cached["chapters"])
+        st.session_state.book_name = cached.get("name", "book")
         st.toast(f"Restored: {cached.get('name', 'book')}")
     else:
         st.info("Upload a file or paste text in the sidebar.")
@@ -311,7 +713,7 @@ def _on_ch_change():
 st.selectbox(
     "Chapter",
     range(len(chs)),
-    format_func=lambda i: f"{i + 1}. {chs[i]['title']}",
+    format_func=lambda i: f"{i + 1}. {chs[i].title}",
     key="ch_idx",
     on_change=_on_ch_change,
 )
@@ -321,14 +723,32 @@ _stop_slot = st.empty()
 if st.session_state.pop("_ch_changed", False):
     with _stop_slot:
         player_action("stop")
+    _stop_pipeline()
 
 ch = chs[st.session_state.ch_idx]
-ch_chunks = chunk_text(ch["text"], wpc)
+
+if st.button("🧹 AI Clean", help="Strip page numbers, running headers and other artifacts with Gemini."):
+    # digests of chapter texts AI Clean produced, so a repeat click doesn't
+    # re-send (and pay for) a chapter that is already clean
+    cleaned = st.session_state.setdefault("_cleaned", set())
+    if hashlib.blake2b(ch.text.encode(), digest_size=8).digest() in cleaned:
+        st.info("This chapter is already cleaned.")
+    else:
+        with st.spinner("Cleaning chapter…"):
+            try:
+                ch.text = ai_clean(client, ch.text)
+                cleaned.add(hashlib.blake2b(ch.text.encode(), digest_size=8).digest())
+                _stop_pipeline()
+                _save_cache(st.session_state.get("book_name", "book"), chs)
+            except Exception as e:
+                st.error(f"AI Clean failed: {e}")
+
+ch_chunks = _chunked(ch.text, wpc)
 
 start = st.slider("Start from chunk", 1, max(len(ch_chunks), 1), 1) - 1
 st.caption(
     f"Ch {st.session_state.ch_idx + 1}/{len(chs)} · "
-    f"{len(ch_chunks)} chunks · {len(ch['text'].split())} words"
+    f"{len(ch_chunks)} chunks · {len(ch.text.split())} words"
 )
 
 # ── Player controls ─────────────────────────────────────
@@ -369,84 +789,159 @@ document.querySelectorAll('.sb').forEach(function(b){
 </script>
 """, height=42)
 
-progress_bar = st.empty()
-transcript = st.empty()
-
-# ── Pipeline: cross-chapter, 1-ahead prefetch ───────────
-if play:
-    # Build flat playlist from current chapter+chunk to end of book
-    playlist = []  # (ch_idx, ch_title, ck_1based, ch_total, text)
-    for ci in range(st.session_state.ch_idx, len(chs)):
-        cks = chunk_text(chs[ci]["text"], wpc)
-        first = start if ci == st.session_state.ch_idx else 0
+# ── Pipeline: cross-chapter, N-ahead prefetch ───────────
+_TTS_TIMEOUT = 90  # seconds a chunk may take before playback gives up
+_BUFFER_MAX = 16  # finished-but-unplayed chunks held while the head is slow
+_MEMO_MAX = 32  # recent chunk futures kept per session for reuse
+
+def _playlist(chs, ch_idx, start, wpc):
+    """Yield (ch_idx, ch_title, ck_1based, ch_total, text) from the current
+    chapter+chunk to the end of the book. Chapters are chunked on demand, so
+    only the current one is processed before the first TTS request."""
+    for ci in range(ch_idx, len(chs)):
+        cks = _chunked(chs[ci].text, wpc)
+        first = start if ci == ch_idx else 0
         for ki, ck in enumerate(cks[first:], first):
             if ck.strip():
-                playlist.append((ci, chs[ci]["title"], ki + 1, len(cks), ck))
+                yield ci, chs[ci].title, ki + 1, len(cks), ck
+
+
+def _submit_chunk(pb, text):
+    """submit_tts, reusing the pending or finished future of an identical
+    recent chunk: repeats within a book (scene breaks, epigraphs) and chunks
+    replayed after Stop or a new start point. The memo is a session-scoped
+    LRU keyed by (voice, prefix, text), so hits skip even the disk cache.
+    Cancelled and failed futures are resubmitted, so a transient API error
+    isn't replayed on every later Play."""
+    memo = st.session_state.setdefault("_tts_memo", {})
+    key = (pb["voice"], pb["prefix"], text)
+    fut = memo.pop(key, None)
+    if fut is None or fut.cancelled() or (fut.done() and fut.exception() is not None):
+        fut = submit_tts(pb["client"], text, pb["voice"], pb["prefix"])
+    memo[key] = fut
+    while len(memo) > _MEMO_MAX:
+        memo.pop(next(iter(memo)))
+    return fut
 
-    if not playlist:
+
+if play:
+    _stop_pipeline()
+    playlist = _playlist(chs, st.session_state.ch_idx, start, wpc)
+    pb = {
+        "gen": time.time_ns() // 1_000_000,  # playback session id
+        "playlist": playlist, "client": client, "voice": voice,
+        "prefix": style_prefix(style), "opus": opus, "low_rate": low_rate,
+        "depth": depth,
+        "ch_start": st.session_state.ch_idx, "lines": [], "prev_ch": -1,
+        "done": 0, "progress": None, "result": None,
+    }
+    # (item, future, submitted_at), consumed in submission order so audio stays sequential
+    pb["inflight"] = deque(
+        (item, _submit_chunk(pb, item[4]), time.monotonic())
+        for item in islice(playlist, depth)
+    )
+
+    if not pb["inflight"]:
         st.warning("No text to read.")
     else:
-        init_player()
-        time.sleep(0.1)
+        init_player(pb["gen"])
+        st.session_state._pb = pb
+
+_pb = st.session_state.get("_pb")
+
+
+@st.fragment(run_every=0.5 if _pb and not _pb["result"] else None)
+def _pipeline():
+    """One pipeline step: forward every finished chunk at the head of the
+    window to the player and refill the window. Runs as a timed fragment, so
+    the rest of the page stays interactive while the book plays."""
+    pb = st.session_state.get("_pb")
+    if not pb:
+        return
+    inflight = pb["inflight"]
+    if not pb["result"]:
         audio_box = st.container()
-        lines = []
-        prev_ch = -1
-        executor = ThreadPoolExecutor(max_workers=1)
-        try:
-            fut = executor.submit(tts, client, playlist[0][4], voice, style)
-            for i, (ci, title, ck_num, ch_tot, chunk) in enumerate(playlist):
-                try:
-                    pcm = fut.result(timeout=90)
-                except Exception as e:
-                    progress_bar.error(f"[{title}] chunk {ck_num} failed: {e}")
-                    break
-
-                # prefetch next chunk (may be from the next chapter)
-                if i + 1 < len(playlist):
-                    fut = executor.submit(
-                        tts, client, playlist[i + 1][4], voice, style
-                    )
-
-                send_audio(pcm, audio_box)
-
-                if ci != prev_ch:
-                    lines.append(f"── {title} ──")
-                    prev_ch = ci
-                lines.append(chunk)
-
-                progress_bar.progress(
-                    (i + 1) / len(playlist),
-                    f"{title} · {ck_num}/{ch_tot}",
-                )
-                transcript.text_area(
-                    "Transcript",
-                    "\n\n".join(lines),
-                    height=200,
-                    disabled=True,
-                )
-        finally:
-            executor.shutdown(wait=False, cancel_futures=True)
-
-        if lines:
-            n_chs = prev_ch - st.session_state.ch_idx + 1
-            progress_bar.success(
-                f"Done — {len(playlist)} chunks, {n_chs} chapter(s)"
-            )
-
-# Keep mobile browser tab alive with silent oscillator
-components.html("""<script>
+        while inflight and inflight[0][1].done():
+            (ci, title, ck_num, ch_tot, chunk), fut, _ = inflight.popleft()
+            try:
+                pcm = fut.result()
+            except Exception as e:
+                pb["result"] = ("error", f"[{title}] chunk {ck_num} failed: {e}")
+                break
+
+            send_audio(pcm, audio_box, pb["gen"], pb["opus"], pb["low_rate"])
+            pb["done"] += 1
+
+            if ci != pb["prev_ch"]:
+                pb["lines"].append(f"── {title} ──")
+                pb["prev_ch"] = ci
+            pb["lines"].append(chunk)
+            pb["progress"] = (ck_num / ch_tot, f"{title} · {ck_num}/{ch_tot}")
+
+        # Top up by *pending* requests, not by window length: if the head chunk
+        # is slow, later ones that finished stay buffered in order while new
+        # requests keep the API busy (may reach into the next chapter).
+        pending = sum(not fut.done() for _, fut, _ in inflight)
+        while not pb["result"] and pending < pb["depth"] and len(inflight) < _BUFFER_MAX:
+            nxt = next(pb["playlist"], None)
+            if not nxt:
+                break
+            inflight.append((nxt, _submit_chunk(pb, nxt[4]), time.monotonic()))
+            pending += 1
+
+        if pb["result"]:
+            pass
+        elif not inflight:
+            n_chs = pb["prev_ch"] - pb["ch_start"] + 1
+            pb["result"] = ("success", f"Done — {pb['done']} chunks, {n_chs} chapter(s)")
+        elif time.monotonic() - inflight[0][2] > _TTS_TIMEOUT:
+            _, title, ck_num, _, _ = inflight[0][0]
+            pb["result"] = ("error", f"[{title}] chunk {ck_num} timed out")
+
+        if pb["result"]:
+            for _, fut, _ in inflight:
+                fut.cancel()
+            inflight.clear()
+            st.rerun()  # full rerun switches the fragment timer off
+
+    if pb["result"]:
+        kind, msg = pb["result"]
+        getattr(st, kind)(msg)
+    elif pb["progress"]:
+        st.progress(*pb["progress"])
+    if pb["lines"]:
+        st.text_area("Transcript", "\n\n".join(pb["lines"]), height=200, disabled=True)
+
+
+_pipeline()
+
+# Keep mobile browser tab alive with a silent oscillator while it is hidden.
+# One visibilitychange listener: resume the oscillator when the tab is hidden,
+# suspend it when foregrounded, and reload if the WebSocket dropped meanwhile
+# (only once nothing is playing, so queued audio isn't cut off). Installed in
+# the parent page so the listener outlives this iframe being remounted.
+_parent_script("""
 (function() {
-    var p = window.parent;
+    var p = window;
     if (p._keepAlive) return;
     p._keepAlive = true;
+    var ka = null;
     try {
-        var ka = new AudioContext();
+        ka = new p.AudioContext();
         var osc = ka.createOscillator();
         var gain = ka.createGain();
         gain.gain.value = 0.0;
         osc.connect(gain);
         gain.connect(ka.destination);
         osc.start();
+        if (!p.document.hidden) ka.suspend();
     } catch(e) {}
+    p.document.addEventListener('visibilitychange', function() {
+        if (p.document.hidden) { if (ka) ka.resume(); return; }
+        if (ka) ka.suspend();
+        var w = p.document.querySelector("[data-testid='stStatusWidget']");
+        var idle = !(p._player && p._player.current);
+        if (idle && w && /connect/i.test(w.textContent)) p.location.reload();
+    });
 })();
-</script>""", height=0)
+""")
@@ -1,23 +1,71 @@
 """File parsers — extract chapters from epub, pdf, docx, txt, md, mobi."""
 
-import re, tempfile, warnings
+import io, os, re, sys, tempfile, threading, warnings
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 
 warnings.filterwarnings("ignore", category=UserWarning, module="ebooklib")
 
-# ── Chapter heading pattern ─────────────────────────────
-_CH_RE = re.compile(
-    r"^(?:"
-    r"(?:chapter|ch\.?)\s+[\d\w]+[:\.\s\-—]*.*|"
-    r"(?:part|section)\s+[\d\w]+[:\.\s\-—]*.*|"
-    r"#{1,3}\s+.+"
-    r")$",
-    re.IGNORECASE | re.MULTILINE,
+try:
+    import re2  # google-re2: linear-time DFA matching, no backtracking blowups
+except ImportError:
+    re2 = None
+
+
+@lru_cache(maxsize=256)
+def _compile(pattern):
+    """Compile with RE2 when installed, else `re`. Flags go inline in the
+    pattern since RE2 doesn't take `re` flag bits. Memoized: the chapter-gap
+    hunt builds its patterns per book, and RE2 has no compile cache of its own."""
+    return re2.compile(pattern) if re2 else re.compile(pattern)
+
+
+# ── Chapter heading patterns ────────────────────────────
+# Tried in descending order of dependability; the first tier that matches
+# anything defines the chapters. Heading lines stay on one line ([ \t], not
+# \s) and are short, so a match never swallows the paragraph below it.
+# "# Chapter 1" is left to the markdown tier, which also catches the book's
+# other #-headings (Prologue, Epilogue, ...).
+_CH_KEY = r"(?im)^[ \t]*(?:chapter|ch\.?|part|section|volume)[ \t]+"
+_NUM_WORD = (
+    r"(?:one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|"
+    r"thirteen|fourteen|fifteen|sixteen|seventeen|eighteen|nineteen|"
+    r"twenty|thirty|forty|fifty|sixty|seventy|eighty|ninety|hundred)"
+)
+_ORDINAL = (
+    r"(?:first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth|"
+    r"eleventh|twelfth|last|final)"
+)
+_CH_TAIL = r"\b.{0,100}$"
+
+_CH_STRICT = _compile(  # Chapter 12 / CHAPTER TWENTY-ONE / Part IV / Section First
+    _CH_KEY + rf"(?:\d+|[ivxlcdm]+|{_NUM_WORD}(?:[- ]{_NUM_WORD})*|{_ORDINAL})" + _CH_TAIL
+)
+_CH_ROMAN = _compile(r"(?m)^[ \t]*[IVXLCDM]+\.?[ \t]*$")  # bare "IV." heading lines
+_CH_MD = _compile(r"(?m)^#{1,3}[ \t]+\S.*$")  # markdown headings
+_CH_CASCADE = (_CH_STRICT, _CH_ROMAN, _CH_MD)
+# keyword + numeral of a strict heading, for spotting gaps in the numbering
+_CH_NUM = _compile(r"(?i)(chapter|ch\.?|part|section|volume)[ \t]+(\d+|[ivxlcdm]+)\b")
+_HUNT_MAX_GAP = 5  # wider gaps are more likely a different numbering than missed headings
+_ROMAN = {"i": 1, "v": 5, "x": 10, "l": 50, "c": 100, "d": 500, "m": 1000}
+_ROMAN_STEPS = (
+    (1000, "M"), (900, "CM"), (500, "D"), (400, "CD"), (100, "C"), (90, "XC"),
+    (50, "L"), (40, "XL"), (10, "X"), (9, "IX"), (5, "V"), (4, "IV"), (1, "I"),
 )
 
 
-def parse_file(file_obj, filename: str) -> list[dict]:
+@dataclass(slots=True)
+class Chapter:
+    title: str
+    text: str
+
+
+def parse_file(file_obj, filename: str) -> list[Chapter]:
     """Route to the correct parser based on file extension."""
     ext = Path(filename).suffix.lower()
     router = {
@@ -31,132 +79,273 @@ def parse_file(file_obj, filename: str) -> list[dict]:
     return fn(file_obj)
 
 
-def parse_pasted_text(text: str) -> list[dict]:
+def parse_pasted_text(text: str) -> list[Chapter]:
     return _detect_chapters(text)
 
 
 # ── Shared helpers ──────────────────────────────────────
 
-def _detect_chapters(text: str) -> list[dict]:
-    """Split text on chapter headings; falls back to single chapter."""
+def _detect_chapters(text: str) -> list[Chapter]:
+    """Split text on chapter headings (first matching tier); falls back to single chapter."""
     text = text.strip()
-    markers = list(_CH_RE.finditer(text))
+    markers = []
+    for rx in _CH_CASCADE:
+        # a markdown heading needs '#' at a line start: two memchr-speed
+        # checks rule the regex pass out for books without any
+        if rx is _CH_MD and not (text.startswith("#") or "\n#" in text):
+            continue
+        markers = list(rx.finditer(text))
+        if markers:
+            break
+    if rx is _CH_STRICT:
+        markers = _hunt_missing(text, markers)
     if not markers:
-        return [{"title": "Full Text", "text": text}]
+        return [Chapter("Full Text", text)]
 
     chapters = []
     # content before the first heading
     pre = text[: markers[0].start()].strip()
     if pre and len(pre) > 100:
-        chapters.append({"title": "Preface", "text": pre})
+        chapters.append(Chapter("Preface", pre))
 
-    for i, m in enumerate(markers):
-        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+    ends = [m.start() for m in markers[1:]]
+    ends.append(len(text))
+    for m, end in zip(markers, ends):
         body = text[m.end() : end].strip()
         if body:
-            chapters.append({
-                "title": m.group().strip().lstrip("#").strip(),
-                "text": body,
-            })
-    return chapters or [{"title": "Full Text", "text": text}]
+            # recovered headings carry their title in group 1, the tiers in group 0
+            chapters.append(Chapter(_title(m.group(m.re.groups)), body))
+    return chapters or [Chapter("Full Text", text)]
+
+
+_HEAD_CLEAN = re.compile(r"^[#\s]+|\s+$")
+
+
+def _title(heading: str) -> str:
+    """Heading line → title in one pass. Short titles are interned: the same
+    "Prologue"/"Chapter 1" strings recur across books and sessions."""
+    t = _HEAD_CLEAN.sub("", heading)
+    return sys.intern(t) if len(t) <= 64 else t
+
+
+def _roman_value(s: str) -> int:
+    vals = [_ROMAN[c] for c in s.lower()]
+    return sum(-v if v < nxt else v for v, nxt in zip(vals, vals[1:] + [0]))
+
+
+def _to_roman(n: int) -> str:
+    out = []
+    for v, sym in _ROMAN_STEPS:
+        k, n = divmod(n, v)
+        out.append(sym * k)
+    return "".join(out)
+
+
+def _heading_number(m):
+    """(keyword, is_roman, number) of a strict heading match, or None."""
+    k = _CH_NUM.search(m.group())
+    if not k:
+        return None
+    kw, num = k.group(1).lower(), k.group(2)
+    return (kw, False, int(num)) if num.isdigit() else (kw, True, _roman_value(num))
+
+
+def _hunt_missing(text: str, markers: list) -> list:
+    """Look for headings the cascade missed: where numbering jumps (3 → 5),
+    search the text between the two markers for the missing number in the
+    same keyword + numeral format, with looser spacing and a little leading
+    noise allowed (OCR page numbers, a glued running header)."""
+    nums = [_heading_number(m) for m in markers]
+    out = markers[:1]
+    for i in range(1, len(markers)):
+        a, b = nums[i - 1], nums[i]
+        if a and b and a[:2] == b[:2] and 1 < b[2] - a[2] <= _HUNT_MAX_GAP:
+            kw, roman = a[:2]
+            pos, end = markers[i - 1].end(), markers[i].start()
+            for n in range(a[2] + 1, b[2]):
+                num = _to_roman(n) if roman else str(n)
+                # the group is the title: keyword onward, without the leading noise
+                rx = _compile(rf"(?im)^[^\n]{{0,10}}?(\b{re.escape(kw)}[ \t]*{num}\b.{{0,100}})$")
+                hit = rx.search(text, pos, end)
+                if hit:
+                    out.append(hit)
+                    pos = hit.end()
+        out.append(markers[i])
+    return out
+
+
+_DROP_TAGS = ("script", "style", "nav", "header", "footer")
+_COLLAPSE_NL = re.compile(r"\n(?:[ \t]*\n){2,}")  # 3+ newlines, incl. indentation-only lines
+_local = threading.local()
+
+
+def _html_parser():
+    """Per-thread lxml parser (one parser can't serve threads concurrently).
+    epub XHTML is UTF-8 and mobi HTML is re-encoded to UTF-8 below: declaring
+    it up front skips libxml2's encoding sniff of every document."""
+    p = getattr(_local, "parser", None)
+    if p is None:
+        p = _local.parser = lxml.html.HTMLParser(encoding="utf-8")
+    return p
+
+
+def _html_root(html_bytes):
+    if isinstance(html_bytes, str):
+        html_bytes = html_bytes.encode()
+    if not html_bytes or html_bytes.isspace():  # no stripped copy of every document
+        return None
+    return lxml.html.document_fromstring(html_bytes, parser=_html_parser())
+
+
+def _root_text(root) -> str:
+    etree.strip_elements(root, *_DROP_TAGS, with_tail=False)  # C-level; tail text stays
+    text = "\n".join(root.itertext())
+    return _COLLAPSE_NL.sub("\n\n", text).strip()
 
 
 def _clean_html(html_bytes) -> str:
     """Strip HTML to plain text."""
-    if isinstance(html_bytes, str):
-        html_bytes = html_bytes.encode()
-    soup = BeautifulSoup(html_bytes, "html.parser")
-    for tag in soup(["script", "style", "nav", "header", "footer"]):
-        tag.decompose()
-    text = soup.get_text(separator="\n")
-    return re.sub(r"\n{3,}", "\n\n", text).strip()
+    root = _html_root(html_bytes)
+    return _root_text(root) if root is not None else ""
 
 
-def _heading_from_html(html_bytes) -> str | None:
-    soup = BeautifulSoup(html_bytes, "html.parser")
-    h = soup.find(["h1", "h2", "h3"])
-    return h.get_text(strip=True) if h else None
+def _extract_epub_item(html_bytes) -> tuple[str | None, str]:
+    """(first h1-h3 heading, plain text) from a single parse of the document."""
+    root = _html_root(html_bytes)
+    if root is None:
+        return None, ""
+    h = next(root.iter("h1", "h2", "h3"), None)  # before the drop: may sit in <header>
+    heading = "".join(s.strip() for s in h.itertext()) if h is not None else None
+    return heading, _root_text(root)
 
 
 # ── Format parsers ──────────────────────────────────────
 
-def _parse_text(f) -> list[dict]:
-    raw = f.read()
-    if isinstance(raw, bytes):
-        raw = raw.decode("utf-8", errors="ignore")
+def _parse_text(f) -> list[Chapter]:
+    if hasattr(f, "getbuffer"):
+        # BytesIO / Streamlit upload: decode straight from its buffer instead
+        # of read() copying the whole file into a bytes object first
+        with f.getbuffer() as buf:
+            raw = str(buf[f.tell():], "utf-8", errors="ignore")
+    else:
+        raw = f.read()
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8", errors="ignore")
     return _detect_chapters(raw)
 
 
-def _parse_pdf(f) -> list[dict]:
+def _pdf_page_texts(f):
+    """Yield each page's text. Uses PyMuPDF (MuPDF, C) when installed, which
+    is many times faster than pdfplumber's pure-Python pdfminer stack."""
+    try:
+        import pymupdf
+    except ImportError:
+        pymupdf = None
+
+    if pymupdf:
+        with pymupdf.open(stream=f.read() if hasattr(f, "read") else f, filetype="pdf") as doc:
+            for page in doc:
+                yield page.get_text()
+        return
+
     import pdfplumber
-    pages = []
     with pdfplumber.open(f) as pdf:
         for p in pdf.pages:
             t = p.extract_text()
-            if t:
-                pages.append(t)
+            p.close()  # drop the page's parsed chars/layout cache as soon as its text is out
+            yield t
+
+
+def _parse_pdf(f) -> list[Chapter]:
+    pages = [t.strip() for t in _pdf_page_texts(f) if t and not t.isspace()]
     return _detect_chapters("\n\n".join(pages))
 
 
-def _parse_docx(f) -> list[dict]:
+def _parse_docx(f) -> list[Chapter]:
     from docx import Document
     doc = Document(f)
     chapters, title, body = [], None, []
     for para in doc.paragraphs:
         if para.style and para.style.name.startswith("Heading"):
             if body:
-                chapters.append({"title": title or "Untitled", "text": "\n".join(body).strip()})
+                chapters.append(Chapter(title or "Untitled", "\n".join(body).strip()))
             title = para.text.strip()
             body = []
         elif para.text.strip():
             body.append(para.text)
     if body:
-        chapters.append({"title": title or "Full Text", "text": "\n".join(body).strip()})
+        chapters.append(Chapter(title or "Full Text", "\n".join(body).strip()))
     if not chapters:
         text = "\n".join(p.text for p in doc.paragraphs if p.text.strip())
         return _detect_chapters(text)
     return chapters
 
 
-def _parse_epub(f) -> list[dict]:
+_SKIP_NAME = _compile(r"(?i)(?:^|[\W_])(?:cover|toc|nav|titlepage|copyright)(?:[\W_\d]|$)")
+_TAG_B = re.compile(rb"<[^>]*>")
+_SMALL_ITEM = 2048  # bytes; only items this small are candidates for the skip
+
+
+def _epub_boilerplate(item) -> bool:
+    """Cheap pre-parse skip for small items only: cover/ToC/copyright pages by
+    file name, and pages whose text can't reach the 50-char chapter minimum.
+    Works on the raw file bytes, so nothing is parsed or serialized here;
+    replacing each tag with a newline over-estimates the parsed text."""
+    html = item.content or b""
+    if len(html) >= _SMALL_ITEM:
+        return False
+    return bool(_SKIP_NAME.search(Path(item.get_name()).stem)) or (
+        len(_TAG_B.sub(b"\n", html).strip()) < 50
+    )
+
+
+def _epub_item_text(item) -> tuple[str | None, str]:
+    # get_content() re-parses and serializes the item, so it runs in the worker
+    return _extract_epub_item(item.get_content())
+
+
+def _iter_epub(f) -> Iterator[Chapter]:
+    """Yield the book's chapters in spine order as their items finish parsing."""
     import ebooklib
     from ebooklib import epub
 
-    with tempfile.NamedTemporaryFile(suffix=".epub", delete=False) as tmp:
-        tmp.write(f.read() if hasattr(f, "read") else f)
-        path = tmp.name
-    try:
-        book = epub.read_epub(path)
-
-        # build ToC title lookup (href → title)
-        toc_map = {}
-        for entry in book.toc:
-            if isinstance(entry, epub.Link):
-                toc_map[entry.href.split("#")[0]] = entry.title
-            elif isinstance(entry, tuple):
-                for link in entry[1]:
-                    if isinstance(link, epub.Link):
-                        toc_map[link.href.split("#")[0]] = link.title
-
-        chapters = []
-        for item_id, _ in book.spine:
-            item = book.get_item_with_id(item_id)
-            if not item or item.get_type() != ebooklib.ITEM_DOCUMENT:
-                continue
-            html = item.get_content()
-            text = _clean_html(html)
+    # ebooklib ≥ 0.20 opens the zip from any seekable file object, so the
+    # upload is read in place rather than copied to a temp file first
+    book = epub.read_epub(f if hasattr(f, "seek") else io.BytesIO(f))
+
+    # build ToC title lookup (href → title)
+    toc_map = {}
+    for entry in book.toc:
+        if isinstance(entry, epub.Link):
+            toc_map[entry.href.split("#")[0]] = entry.title
+        elif isinstance(entry, tuple):
+            for link in entry[1]:
+                if isinstance(link, epub.Link):
+                    toc_map[link.href.split("#")[0]] = link.title
+
+    items = [book.get_item_with_id(item_id) for item_id, _ in book.spine]
+    items = [
+        it for it in items
+        if it and it.get_type() == ebooklib.ITEM_DOCUMENT and not _epub_boilerplate(it)
+    ]
+
+    # lxml parses with the GIL released, so spine items parse in parallel;
+    # map() keeps spine order
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+        results = pool.map(_epub_item_text, items)
+        for item, (heading, text) in zip(items, results):
             if len(text) < 50:
                 continue
             fname = item.get_name()
-            title = toc_map.get(fname) or _heading_from_html(html) or Path(fname).stem
-            chapters.append({"title": title, "text": text})
+            yield Chapter(toc_map.get(fname) or heading or Path(fname).stem, text)
 
-        return chapters or [{"title": "Full Text", "text": "No readable content found."}]
-    finally:
-        Path(path).unlink(missing_ok=True)
+
+def _parse_epub(f) -> list[Chapter]:
+    # the app needs the whole list (chapter picker, cache), so materialize here
+    return list(_iter_epub(f)) or [Chapter("Full Text", "No readable content found.")]
 
 
-def _parse_mobi(f) -> list[dict]:
+def _parse_mobi(f) -> list[Chapter]:
     try:
         import mobi
     except ImportError: